@@ -1,8 +1,12 @@
-from passlib.context import CryptContext
+import sys
+from argon2 import PasswordHasher
 
-# Make sure this context is the same as in your FastAPI code.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Make sure these parameters match password_hasher in your FastAPI code.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 
-# Generate a hash for the password "admin"
-hashed = pwd_context.hash("GV<#P!Q+3H^5xq%*T'fS.t")
-print(hashed)
+# Usage: python -m app.add_pswd <password>
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m app.add_pswd <password>")
+    hashed = password_hasher.hash(sys.argv[1])
+    print(hashed)
@@ -0,0 +1,38 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+CHANNELS = ("t1", "t2", "t3", "t4")
+
+def fit_voltage_channels(rows: Sequence[Tuple[float, float, float, float, float]]) -> List[dict]:
+    # rows are (measured_temperature, voltage_t1, ..., voltage_t4); split them into
+    # one column per field so every channel is fitted in a single vectorized pass.
+    data = np.asarray(rows, dtype=np.float64).reshape(-1, 1 + len(CHANNELS))
+    temperature = data[:, 0]
+    voltages = data[:, 1:].T  # shape: (channels, samples)
+
+    count = temperature.shape[0]
+    if count == 0:
+        return [{"channel": ch, "count": 0, "meanVoltage": None, "slope": None, "intercept": None} for ch in CHANNELS]
+
+    # Least-squares line temperature = slope * voltage + intercept, per channel
+    mean_v = voltages.mean(axis=1)
+    mean_t = temperature.mean()
+    dv = voltages - mean_v[:, None]
+    var_v = (dv * dv).sum(axis=1)
+    cov_vt = (dv * (temperature - mean_t)).sum(axis=1)
+
+    results = []
+    for i, ch in enumerate(CHANNELS):
+        slope: Optional[float] = None
+        intercept: Optional[float] = None
+        if var_v[i] > 0:
+            slope = float(cov_vt[i] / var_v[i])
+            intercept = float(mean_t - slope * mean_v[i])
+        results.append({
+            "channel": ch,
+            "count": count,
+            "meanVoltage": float(mean_v[i]),
+            "slope": slope,
+            "intercept": intercept,
+        })
+    return results
@@ -1,16 +1,29 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlmodel import SQLModel, Session, create_engine, select
+from sqlalchemy import bindparam, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.models import User, CalibrationProject, CalibrationLog
-from typing import List, Optional
-from datetime import datetime
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from app.analytics import fit_voltage_channels
+from app.migrations import run_migrations
+from typing import List, Literal, Optional
+from datetime import datetime, timedelta, timezone
+import jwt
+from jwt import InvalidTokenError
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from fastapi import Depends, status, Form, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import os
+import uuid
+import orjson
+import time
+from cachetools import TTLCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -19,43 +32,64 @@ SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Decoded tokens -> (user, token expiry); entries never outlive the token itself
+TOKEN_CACHE_TTL_SECONDS = 60
+token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# New hashes use Argon2id (OWASP parameters); older bcrypt hashes still verify
+# and get upgraded on the next successful login.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# bcrypt only looks at the first 72 bytes of a password (passlib truncated silently too)
+BCRYPT_MAX_PASSWORD_BYTES = 72
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    if hashed_password.startswith("$argon2"):
+        try:
+            return password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return bcrypt.checkpw(plain_password.encode()[:BCRYPT_MAX_PASSWORD_BYTES], hashed_password.encode())
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    expires_in = int(expires_delta.total_seconds()) if expires_delta else 15 * 60
+    to_encode.update({"exp": int(time.time()) + expires_in})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = token_cache.get(token)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > time.time():
+            return user
+        token_cache.pop(token, None)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = {"username": username, "permission": payload.get("permission")}
-    except JWTError:
+    except InvalidTokenError:
         raise credentials_exception
-    with Session(engine) as session:
-        statement = select(User).where(User.username == username)
-        user = session.exec(statement).first()
-        if user is None:
-            raise credentials_exception
+    user = await get_user_by_username(username)
+    if user is None:
+        raise credentials_exception
+    expires_at = min(time.time() + TOKEN_CACHE_TTL_SECONDS, payload.get("exp", 0))
+    token_cache[token] = (user, expires_at)
     return user
 
 def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
@@ -68,10 +102,81 @@ def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
 
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///database.db")
-engine = create_engine(DATABASE_URL, echo=True)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+# libpq connection options that asyncpg doesn't accept as connect() arguments
+LIBPQ_ONLY_OPTIONS = ("channel_binding", "gssencmode")
+
+def to_async_url(url: str) -> str:
+    # Map plain driver URLs onto their async drivers (aiosqlite / asyncpg).
+    parsed = make_url(url)
+    if parsed.drivername == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    elif parsed.drivername in ("postgres", "postgresql"):
+        # Hosted Postgres URLs usually carry ?sslmode=require; asyncpg calls it ssl
+        query = dict(parsed.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        for option in LIBPQ_ONLY_OPTIONS:
+            query.pop(option, None)
+        parsed = parsed.set(drivername="postgresql+asyncpg", query=query)
+    return parsed.render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+# SQL statement logging is off unless explicitly requested (e.g. SQL_ECHO=1 for local debugging)
+SQL_ECHO = os.environ.get("SQL_ECHO") == "1"
+
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    # SQLite is local-only; the default aiosqlite pool is fine.
+    engine = create_async_engine(ASYNC_DATABASE_URL, echo=SQL_ECHO)
+else:
+    # Keep warm connections around instead of reconnecting on every request.
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=SQL_ECHO,
+        pool_size=20,
+        max_overflow=10,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_timeout=30,
+    )
+
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def create_db_and_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(run_migrations)
+
+# Built once; only the bound username changes between calls
+user_by_username_statement = select(User).where(User.username == bindparam("username"))
+
+# The user table is small, so keep recently seen users in memory for a short while
+USER_CACHE_TTL_SECONDS = 30
+user_cache = TTLCache(maxsize=1000, ttl=USER_CACHE_TTL_SECONDS)
+
+async def update_password_hash(user_id: int, hashed_password: str):
+    async with SessionLocal() as session:
+        user = await session.get(User, user_id)
+        if user is not None:
+            user.hashed_password = hashed_password
+            session.add(user)
+            await session.commit()
+
+async def get_session():
+    # Yield dependency: FastAPI closes the session once the response has been
+    # sent (or has failed), which also covers streamed responses.
+    async with SessionLocal() as session:
+        yield session
+
+async def get_user_by_username(username: str) -> Optional[User]:
+    user = user_cache.get(username)
+    if user is None:
+        async with SessionLocal() as session:
+            result = await session.exec(user_by_username_statement, params={"username": username})
+            user = result.first()
+        if user is not None:
+            user_cache[username] = user
+    return user
 
 app = FastAPI()
 
@@ -103,11 +208,12 @@ class CalibrationLogCreate(BaseModel):
     voltage_t2: float
     voltage_t3: float
     voltage_t4: float
-    time: Optional[str] = None  # Accepts an ISO formatted datetime string
+    time: Optional[datetime] = None  # ISO formatted datetime, parsed by pydantic
 
 class CalibrationLogResponse(BaseModel):
     calibrationNumber: int
     time: str
+    timestamp: int      # numeric timestamp in ms
     measuredTemperature: float
     measuredVoltageT1: float
     measuredVoltageT2: float
@@ -115,7 +221,7 @@ class CalibrationLogResponse(BaseModel):
     measuredVoltageT4: float
 
 class CalibrationProjectResponse(BaseModel):
-    id: str
+    id: uuid.UUID
     name: str
     created_at: datetime
     user_id: int
@@ -124,48 +230,51 @@ class CalibrationProjectResponse(BaseModel):
 
 # === Routes ===
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    await create_db_and_tables()
+    # Build the OpenAPI schema once up front; FastAPI caches it on the app
+    app.openapi()
 
 @app.get("/admin-only")
-def admin_only_route(current_user: User = Depends(get_current_admin)):
+async def admin_only_route(current_user: User = Depends(get_current_admin)):
     return {"message": f"Welcome, admin {current_user.username}!"}
 
 
 @app.post("/login")
-def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
-    with Session(engine) as session:
-        statement = select(User).where(User.username == form_data.username)
-        user = session.exec(statement).first()
-        if not user or not verify_password(form_data.password, user.hashed_password):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect username or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        # Create the JWT token with the username and permission level.
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user.username, "permission": user.permission},
-            expires_delta=access_token_expires
+async def login(response: Response, form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await get_user_by_username(form_data.username)
+    # Password hashing is CPU-bound; run it on a worker thread so concurrent logins don't stall the event loop
+    if not user or not await run_in_threadpool(verify_password, form_data.password, user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-        # Option A: Return the token in the response (for Bearer auth)
-        return {"access_token": access_token, "token_type": "bearer", "id": user.id, "username": user.username, "permission": user.permission}
+    if password_needs_rehash(user.hashed_password):
+        new_hash = await run_in_threadpool(get_password_hash, form_data.password)
+        await update_password_hash(user.id, new_hash)
+        user_cache.pop(user.username, None)
+    # Create the JWT token with the username and permission level.
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.username, "permission": user.permission},
+        expires_delta=access_token_expires
+    )
+    # Option A: Return the token in the response (for Bearer auth)
+    return {"access_token": access_token, "token_type": "bearer", "id": user.id, "username": user.username, "permission": user.permission}
 
-        # Option B (for session cookies): Uncomment the following lines to set an HTTP-only cookie.
-        # response.set_cookie(key="access_token", value=access_token, httponly=True)
-        # return {"message": "Logged in successfully", "id": user.id, "username": user.username, "permission": user.permission}
+    # Option B (for session cookies): Uncomment the following lines to set an HTTP-only cookie.
+    # response.set_cookie(key="access_token", value=access_token, httponly=True)
+    # return {"message": "Logged in successfully", "id": user.id, "username": user.username, "permission": user.permission}
 
 @app.get("/calibrations/", response_model=List[CalibrationProjectResponse])
-def get_calibrations():
-    with Session(engine) as session:
-        statement = select(CalibrationProject)
-        projects = session.exec(statement).all()
+async def get_calibrations():
+    async with SessionLocal() as session:
+        # Fetch each project together with its owner in a single query
+        statement = select(CalibrationProject, User).outerjoin(User, CalibrationProject.user_id == User.id)
+        rows = (await session.exec(statement)).all()
         response_projects = []
-        for proj in projects:
-            # Query for the user associated with this project
-            user_statement = select(User).where(User.id == proj.user_id)
-            user = session.exec(user_statement).first()
+        for proj, user in rows:
             response_projects.append(
                 CalibrationProjectResponse(
                     id=proj.id,
@@ -179,75 +288,143 @@ def get_calibrations():
 
 
 @app.post("/calibrations/", response_model=CalibrationProject)
-def create_calibration_project(cal_proj: CalibrationProjectCreate):
+async def create_calibration_project(cal_proj: CalibrationProjectCreate):
     project = CalibrationProject(name=cal_proj.name, user_id=cal_proj.user_id)
-    with Session(engine) as session:
+    async with SessionLocal() as session:
         session.add(project)
-        session.commit()
-        session.refresh(project)
+        await session.commit()
+        await session.refresh(project)
     return project
 
-# Add a new field to include the numeric timestamp.
-class CalibrationLogResponse(BaseModel):
-    calibrationNumber: int
-    time: str
-    timestamp: int      # New: numeric timestamp in ms
-    measuredTemperature: float
-    measuredVoltageT1: float
-    measuredVoltageT2: float
-    measuredVoltageT3: float
-    measuredVoltageT4: float
-
-@app.get("/calibrations/{project_id}/log", response_model=List[CalibrationLogResponse])
-def get_calibration_logs(project_id: str):
-    with Session(engine) as session:
-        statement = select(CalibrationLog).where(CalibrationLog.calibration_project_id == project_id)
-        logs = session.exec(statement).all()
-        
-        response_logs = []
-        for log in logs:
-            response_logs.append(CalibrationLogResponse(
-                calibrationNumber=log.calibration_number,
-                time=log.timestamp.isoformat(),  # full ISO string
-                timestamp=int(log.timestamp.timestamp() * 1000),  # Convert to ms
-                measuredTemperature=log.measured_temperature,
-                measuredVoltageT1=log.measured_voltage_t1,
-                measuredVoltageT2=log.measured_voltage_t2,
-                measuredVoltageT3=log.measured_voltage_t3,
-                measuredVoltageT4=log.measured_voltage_t4
-            ))
-        return response_logs
-    
-@app.post("/calibrations/{project_id}/log", response_model=CalibrationLogResponse)
-def add_calibration_log(project_id: str, log_data: CalibrationLogCreate):
-    # If a time is provided, try to parse it; otherwise, use the current time.
-    if log_data.time:
+def select_log_columns(project_id: uuid.UUID):
+    # Only the scalar columns the log responses use; rows come back as plain
+    # tuples, skipping ORM object construction and the identity map.
+    return select(
+        CalibrationLog.calibration_number,
+        CalibrationLog.timestamp,
+        CalibrationLog.timestamp_ms,
+        CalibrationLog.measured_temperature,
+        CalibrationLog.measured_voltage_t1,
+        CalibrationLog.measured_voltage_t2,
+        CalibrationLog.measured_voltage_t3,
+        CalibrationLog.measured_voltage_t4,
+    ).where(CalibrationLog.calibration_project_id == project_id).order_by(CalibrationLog.timestamp)
+
+# Number of log rows fetched from the database per round trip while streaming
+LOG_STREAM_CHUNK_SIZE = 500
+
+# Read-heavy: rows are streamed from the database in chunks and written out as
+# an orjson-encoded JSON array, so memory stays flat regardless of project size.
+@app.get("/calibrations/{project_id}/log", responses={200: {"model": List[CalibrationLogResponse]}})
+async def get_calibration_logs(
+    project_id: uuid.UUID,
+    format: Literal["rows", "columnar"] = "rows",
+    session: AsyncSession = Depends(get_session, scope="request"),
+):
+    if format == "columnar":
+        return await get_calibration_log_columns(project_id, session)
+
+    statement = select_log_columns(project_id).execution_options(yield_per=LOG_STREAM_CHUNK_SIZE)
+
+    # Run the query before the response starts, so database errors still surface
+    # as a 500 instead of a 200 with a truncated body. The request-scoped session
+    # is closed after the response, even if the body is never consumed.
+    rows = await session.stream(statement)
+
+    async def stream_logs():
         try:
-            # Expecting ISO format (e.g., "2025-02-21T15:30:00")
-            timestamp = datetime.fromisoformat(log_data.time)
-        except ValueError:
-            raise HTTPException(status_code=422, detail="Time must be in ISO format.")
-    else:
-        timestamp = datetime.utcnow()
-
-    log = CalibrationLog(
+            yield b"["
+            separator = b""
+            async for number, ts, ts_ms, temperature, v1, v2, v3, v4 in rows:
+                yield separator + orjson.dumps({
+                    "calibrationNumber": number,
+                    "time": ts.isoformat(),  # full ISO string
+                    "timestamp": ts_ms,
+                    "measuredTemperature": temperature,
+                    "measuredVoltageT1": v1,
+                    "measuredVoltageT2": v2,
+                    "measuredVoltageT3": v3,
+                    "measuredVoltageT4": v4,
+                })
+                separator = b","
+            yield b"]"
+        finally:
+            await rows.close()
+
+    return StreamingResponse(stream_logs(), media_type="application/json")
+
+async def get_calibration_log_columns(project_id: uuid.UUID, session: AsyncSession) -> Response:
+    # Same data as the row format, but one array per field (handy for plotting)
+    rows = (await session.exec(select_log_columns(project_id))).all()
+
+    columns = {
+        "calibrationNumber": [],
+        "time": [],
+        "timestamp": [],
+        "measuredTemperature": [],
+        "measuredVoltageT1": [],
+        "measuredVoltageT2": [],
+        "measuredVoltageT3": [],
+        "measuredVoltageT4": [],
+    }
+    for number, ts, ts_ms, temperature, v1, v2, v3, v4 in rows:
+        columns["calibrationNumber"].append(number)
+        columns["time"].append(ts.isoformat())
+        columns["timestamp"].append(ts_ms)
+        columns["measuredTemperature"].append(temperature)
+        columns["measuredVoltageT1"].append(v1)
+        columns["measuredVoltageT2"].append(v2)
+        columns["measuredVoltageT3"].append(v3)
+        columns["measuredVoltageT4"].append(v4)
+    return Response(orjson.dumps(columns), media_type="application/json")
+
+@app.get("/calibrations/{project_id}/analytics")
+async def get_calibration_analytics(project_id: uuid.UUID):
+    # Only the numeric columns are needed; skip building ORM objects
+    statement = select(
+        CalibrationLog.measured_temperature,
+        CalibrationLog.measured_voltage_t1,
+        CalibrationLog.measured_voltage_t2,
+        CalibrationLog.measured_voltage_t3,
+        CalibrationLog.measured_voltage_t4,
+    ).where(CalibrationLog.calibration_project_id == project_id)
+    async with SessionLocal() as session:
+        rows = (await session.exec(statement)).all()
+    return {"channels": fit_voltage_channels(rows)}
+
+def utc_epoch_ms(timestamp: datetime) -> int:
+    # Stored timestamps are naive UTC; don't let .timestamp() read them as local time
+    return int(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def build_calibration_log(project_id: uuid.UUID, log_data: CalibrationLogCreate) -> CalibrationLog:
+    # Use the current time if the client didn't send one
+    timestamp = log_data.time or datetime.utcnow()
+    if timestamp.tzinfo is not None:
+        # The column is a naive UTC TIMESTAMP; asyncpg refuses aware datetimes for it
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return CalibrationLog(
         calibration_project_id=project_id,
         calibration_number=log_data.calibration_number,
         timestamp=timestamp,
+        timestamp_ms=utc_epoch_ms(timestamp),  # stored so reads don't convert
         measured_temperature=log_data.measured_temperature,
         measured_voltage_t1=log_data.voltage_t1,
         measured_voltage_t2=log_data.voltage_t2,
         measured_voltage_t3=log_data.voltage_t3,
         measured_voltage_t4=log_data.voltage_t4
     )
-    with Session(engine) as session:
+
+@app.post("/calibrations/{project_id}/log", response_model=CalibrationLogResponse)
+async def add_calibration_log(project_id: uuid.UUID, log_data: CalibrationLogCreate):
+    log = build_calibration_log(project_id, log_data)
+    async with SessionLocal() as session:
         session.add(log)
-        session.commit()
-        session.refresh(log)
+        await session.commit()
+        await session.refresh(log)
         response = CalibrationLogResponse(
             calibrationNumber=log.calibration_number,
             time=log.timestamp.isoformat(),  # full ISO string for consistency
-            timestamp=int(log.timestamp.timestamp() * 1000),  # numeric timestamp in ms
+            timestamp=log.timestamp_ms,  # numeric timestamp in ms
             measuredTemperature=log.measured_temperature,
             measuredVoltageT1=log.measured_voltage_t1,
             measuredVoltageT2=log.measured_voltage_t2,
@@ -257,14 +434,23 @@ def add_calibration_log(project_id: str, log_data: CalibrationLogCreate):
 
     return response
 
+@app.post("/calibrations/{project_id}/log:bulk")
+async def add_calibration_logs_bulk(project_id: uuid.UUID, logs_data: List[CalibrationLogCreate]):
+    logs = [build_calibration_log(project_id, log_data) for log_data in logs_data]
+    # One transaction for the whole batch; SQLAlchemy groups the rows into multi-row INSERTs
+    async with SessionLocal() as session:
+        session.add_all(logs)
+        await session.commit()
+    return {"inserted": len(logs)}
+
 
 @app.delete("/calibrations/{project_id}", response_model=CalibrationProject)
-def delete_calibration_project(project_id: str):
-    with Session(engine) as session:
-        project = session.get(CalibrationProject, project_id)
+async def delete_calibration_project(project_id: uuid.UUID):
+    async with SessionLocal() as session:
+        project = await session.get(CalibrationProject, project_id)
         if not project:
             raise HTTPException(status_code=404, detail="Project not found")
-        session.delete(project)
-        session.commit()
+        await session.delete(project)
+        await session.commit()
         return project
 # uvicorn app.main:app --reload
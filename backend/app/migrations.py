@@ -0,0 +1,71 @@
+from datetime import timezone
+from sqlalchemy import DateTime, Uuid, inspect, text
+from sqlalchemy.engine import Connection
+from app.models import CalibrationLog, CalibrationProject
+
+# In-place upgrades for databases created before a schema change. create_all only
+# creates missing tables, so existing ones are brought up to date here. Every step
+# is idempotent; run_migrations is called on startup after create_all.
+
+def convert_project_ids_to_uuid(conn: Connection):
+    # Project ids used to be stored as 36-char hyphenated strings
+    if conn.dialect.name == "sqlite":
+        # Uuid is stored as 32-char lowercase hex on SQLite
+        conn.execute(text(
+            "UPDATE calibrationproject SET id = lower(replace(id, '-', '')) WHERE length(id) = 36"
+        ))
+        conn.execute(text(
+            "UPDATE calibrationlog SET calibration_project_id = lower(replace(calibration_project_id, '-', '')) "
+            "WHERE length(calibration_project_id) = 36"
+        ))
+    elif conn.dialect.name == "postgresql":
+        inspector = inspect(conn)
+        id_column = next(c for c in inspector.get_columns("calibrationproject") if c["name"] == "id")
+        if isinstance(id_column["type"], Uuid):
+            return
+        # The foreign key has to go while both sides change type
+        for fk in inspector.get_foreign_keys("calibrationlog"):
+            if fk["referred_table"] == "calibrationproject":
+                conn.execute(text(f'ALTER TABLE calibrationlog DROP CONSTRAINT "{fk["name"]}"'))
+        conn.execute(text("ALTER TABLE calibrationproject ALTER COLUMN id TYPE uuid USING id::uuid"))
+        conn.execute(text(
+            "ALTER TABLE calibrationlog ALTER COLUMN calibration_project_id TYPE uuid USING calibration_project_id::uuid"
+        ))
+        conn.execute(text(
+            "ALTER TABLE calibrationlog ADD CONSTRAINT calibrationlog_calibration_project_id_fkey "
+            "FOREIGN KEY (calibration_project_id) REFERENCES calibrationproject (id)"
+        ))
+
+def add_log_timestamp_ms(conn: Connection):
+    columns = {c["name"] for c in inspect(conn).get_columns("calibrationlog")}
+    if "timestamp_ms" in columns:
+        return
+    # Added as nullable so existing rows can be backfilled first
+    conn.execute(text("ALTER TABLE calibrationlog ADD COLUMN timestamp_ms BIGINT"))
+    # Backfill with the same conversion build_calibration_log uses for new rows
+    # (stored timestamps are naive UTC)
+    rows = conn.execute(
+        text("SELECT id, timestamp FROM calibrationlog").columns(timestamp=DateTime())
+    ).all()
+    if rows:
+        conn.execute(
+            text("UPDATE calibrationlog SET timestamp_ms = :timestamp_ms WHERE id = :id"),
+            [
+                {"id": row_id, "timestamp_ms": int(ts.replace(tzinfo=timezone.utc).timestamp() * 1000)}
+                for row_id, ts in rows
+            ],
+        )
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE calibrationlog ALTER COLUMN timestamp_ms SET NOT NULL"))
+    # SQLite can't add NOT NULL to an existing column, so it stays nullable there;
+    # the app always writes it.
+
+def create_missing_indexes(conn: Connection):
+    for table in (CalibrationProject.__table__, CalibrationLog.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def run_migrations(conn: Connection):
+    create_missing_indexes(conn)
+    convert_project_ids_to_uuid(conn)
+    add_log_timestamp_ms(conn)
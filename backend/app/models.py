@@ -1,7 +1,7 @@
 import uuid
 from typing import Optional
 from datetime import datetime
-from sqlalchemy import String, Column
+from sqlalchemy import BigInteger, String, Column, DateTime, Index, Uuid
 from sqlmodel import SQLModel, Field
 
 class User(SQLModel, table=True):
@@ -11,17 +11,23 @@ class User(SQLModel, table=True):
     permission: int  # 1 (highest) to 3 (lowest)
 
 class CalibrationProject(SQLModel, table=True):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    # Native 16-byte UUID instead of its 36-char string form
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, sa_type=Uuid(as_uuid=True), primary_key=True)
     name: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    user_id: int = Field(foreign_key="user.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow, sa_type=DateTime())
+    user_id: int = Field(foreign_key="user.id", index=True)
 
 class CalibrationLog(SQLModel, table=True):
+    # Log reads filter by project and order by time (see select_log_columns)
+    __table_args__ = (Index("ix_log_project_time", "calibration_project_id", "timestamp"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    # Change project id to string:
-    calibration_project_id: str = Field(foreign_key="calibrationproject.id")
+    calibration_project_id: uuid.UUID = Field(foreign_key="calibrationproject.id", sa_type=Uuid(as_uuid=True))
     calibration_number: int
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Naive UTC, matching the existing TIMESTAMP (without time zone) columns
+    timestamp: datetime = Field(default_factory=datetime.utcnow, sa_type=DateTime())
+    # Same instant as epoch milliseconds, written on insert (too big for a 32-bit INTEGER)
+    timestamp_ms: int = Field(sa_type=BigInteger())
     measured_temperature: float
     measured_voltage_t1: float
     measured_voltage_t2: float